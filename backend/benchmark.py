@@ -0,0 +1,275 @@
+"""VaultSecure API benchmark suite.
+
+Generates synthetic galleries, drives the ASGI app in-process or over a
+local socket, and prints machine-readable JSON results so runs can be
+compared across deploys.
+
+Usage:
+    python benchmark.py --sizes 100,10000,100000 --transport both --output results.json
+
+Requires httpx (pip install httpx) in addition to the backend requirements.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+import server
+
+# Mixed resolutions: (size, weight) - mostly web-sized with a tail of large originals
+RESOLUTIONS = [((320, 240), 4), ((800, 600), 4), ((1920, 1080), 2), ((4000, 3000), 1)]
+COLORS = ["#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4", "#FFEAA7"]
+UNIQUE_PER_RESOLUTION = 4  # distinct files drawn per resolution; the rest are hardlinks
+
+# "session" runs last: creating a session clears the others for the same client IP
+SCENARIOS = ["listing", "view", "thumbnail", "like", "session"]
+
+
+def generate_gallery(target_dir: Path, count: int) -> Path:
+    """Fill target_dir with count synthetic images at mixed resolutions"""
+    target_dir.mkdir(parents=True, exist_ok=True)
+    existing = sum(1 for _ in target_dir.glob('*'))
+    if existing >= count:
+        return target_dir
+
+    base_dir = target_dir.parent / f".{target_dir.name}-bases"
+    base_dir.mkdir(exist_ok=True)
+    bases = []
+    for (width, height), weight in RESOLUTIONS:
+        for variant in range(UNIQUE_PER_RESOLUTION):
+            base_path = base_dir / f"base_{width}x{height}_{variant}.jpg"
+            if not base_path.exists():
+                color = COLORS[variant % len(COLORS)]
+                img = server.draw_placeholder_image((width, height), color, f"Synthetic {width}x{height}")
+                img.save(base_path, quality=85)
+            bases.extend([base_path] * weight)
+
+    for index in range(existing, count):
+        base_path = bases[index % len(bases)]
+        image_path = target_dir / f"synthetic_{index:06d}.jpg"
+        try:
+            os.link(base_path, image_path)
+        except OSError:
+            shutil.copyfile(base_path, image_path)
+
+    return target_dir
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def summarize(scenario: str, latencies: list, errors: int, elapsed: float, **extra) -> dict:
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "scenario": scenario,
+        **extra,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+async def run_load(client: httpx.AsyncClient, make_request, total: int, concurrency: int):
+    """Issue total requests from concurrency workers; returns (latencies, errors, elapsed)"""
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in remaining:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, index)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_http_scenarios(client: httpx.AsyncClient, size: int, transport: str, args) -> list:
+    results = []
+    session = (await client.post("/api/session")).json()
+    headers = {"X-Session-ID": session["session_id"]}
+    listing = (await client.get("/api/images", headers=headers)).json()
+    if not listing:
+        raise RuntimeError("Gallery listing is empty")
+
+    # Listing cost grows with gallery size, so scale its request count down
+    listing_requests = max(3, min(args.requests, 200000 // size))
+
+    requests = {
+        "session": (args.requests, lambda c, i: c.post("/api/session")),
+        "listing": (listing_requests, lambda c, i: c.get("/api/images", headers=headers)),
+        "view": (args.requests, lambda c, i: c.get(listing[i % len(listing)]["url"])),
+        "thumbnail": (args.requests, lambda c, i: c.get(listing[i % len(listing)]["thumbnail_url"])),
+        "like": (args.requests, lambda c, i: c.post(f"/api/images/{listing[i % len(listing)]['id']}/like",
+                                                     headers=headers)),
+    }
+
+    for scenario in args.scenarios:
+        total, make_request = requests[scenario]
+        latencies, errors, elapsed = await run_load(client, make_request, total, args.concurrency)
+        result = summarize(scenario, latencies, errors, elapsed,
+                           gallery_size=size, transport=transport, concurrency=args.concurrency)
+        print(json.dumps(result), flush=True)
+        results.append(result)
+
+    return results
+
+
+def run_micro_benchmarks(size: int, iterations: int) -> list:
+    """Time the pipeline building blocks directly, without HTTP overhead"""
+    results = []
+    catalog = server.discover_images()
+
+    def measure(scenario, func, count):
+        latencies = []
+        start = time.perf_counter()
+        for index in range(count):
+            call_start = time.perf_counter()
+            func(index)
+            latencies.append(time.perf_counter() - call_start)
+        result = summarize(scenario, latencies, 0, time.perf_counter() - start,
+                           gallery_size=size, transport="micro", concurrency=1)
+        print(json.dumps(result), flush=True)
+        results.append(result)
+
+    measure("catalog_scan", lambda i: server.discover_images(), max(3, min(iterations, 200000 // size)))
+    measure("token_mint", lambda i: server.generate_secure_token(str(i), "bench", "127.0.0.1", "view"),
+            iterations)
+
+    def cold_thumbnail(index):
+        server.encode_thumbnail(Path(catalog[index % len(catalog)]["file_path"]))
+
+    measure("thumbnail_render_cold", cold_thumbnail, min(iterations, 50))
+    return results
+
+
+def clear_server_caches(rendition_dir: Path):
+    shutil.rmtree(rendition_dir, ignore_errors=True)
+    server.RENDITION_DIR = rendition_dir
+    server.clear_rendition_index()
+    server.batch_bundle_cache.clear()
+    server.clear_tile_level_cache()
+    server.listing_fragment_cache.clear()
+    server.verified_token_cache.clear()
+    server.clear_listing_cache()
+    server.active_sessions.clear()
+    server.rate_limiter.clear()
+    server.invalidate_albums()
+    server.album_catalogs.clear()
+    server.view_encoding_cache.clear()
+    server.watermark_stamps.clear()
+    server.watermark_bases.clear()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_in_process(size: int, args) -> list:
+    transport = httpx.ASGITransport(app=server.app, client=("127.0.0.1", 50000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        return await run_http_scenarios(client, size, "inprocess", args)
+
+
+async def run_over_socket(size: int, args) -> list:
+    port = free_port()
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    uvicorn_server = uvicorn.Server(config)
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            return await run_http_scenarios(client, size, "socket", args)
+    finally:
+        uvicorn_server.should_exit = True
+        thread.join(timeout=10)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VaultSecure API benchmark suite")
+    parser.add_argument("--sizes", default="100,10000,100000", help="Comma-separated gallery sizes")
+    parser.add_argument("--transport", choices=["inprocess", "socket", "both"], default="inprocess")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated HTTP scenarios")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-micro", action="store_true", help="Skip the direct micro-benchmarks")
+    parser.add_argument("--work-dir", help="Where to keep synthetic galleries (reused between runs)")
+    parser.add_argument("--output", help="Write the full JSON report to this file")
+    args = parser.parse_args()
+    args.scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.gettempdir()) / "vaultsecure-bench"
+    transports = ["inprocess", "socket"] if args.transport == "both" else [args.transport]
+
+    results = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        server.IMAGES_DIR = generate_gallery(work_dir / f"gallery_{size}", size)
+        clear_server_caches(work_dir / f"renditions_{size}")
+        if not args.no_micro:
+            results.extend(run_micro_benchmarks(size, args.requests))
+        for transport in transports:
+            runner = run_in_process if transport == "inprocess" else run_over_socket
+            results.extend(asyncio.run(runner(size, args)))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "requests_per_scenario": args.requests,
+            "concurrency": args.concurrency
+        },
+        "results": results
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+def album(*files):
+    """AlbumEntries for (position, name, size) files in one directory"""
+    entries = server.AlbumEntries("/gallery")
+    names = b""
+    for position, name, size in files:
+        entries.positions.append(position)
+        entries.shards.append(-1)
+        names += name.encode()
+        entries.name_offsets.append(len(names))
+        entries.mtimes.append(0)
+        entries.sizes.append(size)
+    entries.names = names
+    return entries
+
+
+@pytest.fixture
+def catalog_log(monkeypatch):
+    log = {"version": 100, "floor": 100, "seeded": True, "changes": server.deque()}
+    monkeypatch.setattr(server, "catalog_log", log)
+    return log
+
+
+def scan(previous, current):
+    server.record_catalog_changes("default", previous, current)
+    return current
+
+
+def test_remove_then_add_at_same_id_is_an_update(catalog_log):
+    entries = album((1, "a.jpg", 10), (2, "b.jpg", 20))
+    since = catalog_log["version"]
+    entries = scan(entries, album((1, "a.jpg", 10)))
+    scan(entries, album((1, "a.jpg", 10), (2, "c.jpg", 30)))
+
+    assert server.catalog_changes_since(since) == {("default", 2): "updated"}
+
+
+def test_add_then_update_is_an_add(catalog_log):
+    entries = album((1, "a.jpg", 10))
+    since = catalog_log["version"]
+    entries = scan(entries, album((1, "a.jpg", 10), (3, "c.jpg", 30)))
+    scan(entries, album((1, "a.jpg", 10), (3, "c.jpg", 31)))
+
+    assert server.catalog_changes_since(since) == {("default", 3): "added"}
+
+
+def test_add_then_remove_is_omitted(catalog_log):
+    entries = album((1, "a.jpg", 10))
+    since = catalog_log["version"]
+    entries = scan(entries, album((1, "a.jpg", 10), (3, "c.jpg", 30)))
+    scan(entries, album((1, "a.jpg", 10)))
+
+    assert server.catalog_changes_since(since) == {}
+
+
+def test_since_outside_the_log_needs_a_reset(catalog_log):
+    assert server.catalog_changes_since(catalog_log["floor"] - 1) is None
+    assert server.catalog_changes_since(catalog_log["version"] + 1) is None
+
+
+def test_subdirectories_do_not_take_positions(tmp_path):
+    for name in ("a.jpg", "b.png", "notes.txt"):
+        (tmp_path / name).write_bytes(b"x")
+    before = {entry[1]: entry[0] for entry in server.AlbumEntries.scan(tmp_path)}
+    (tmp_path / "travel").mkdir()
+    (tmp_path / ".incoming").mkdir()
+    (tmp_path / "dir.jpg").mkdir()
+    after = {entry[1]: entry[0] for entry in server.AlbumEntries.scan(tmp_path)}
+
+    assert after == before
+    assert sorted(before.values()) == [1, 2]
+
+
+def test_ids_survive_adds_and_removes(tmp_path):
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (tmp_path / name).write_bytes(b"x")
+    first = server.AlbumEntries.scan(tmp_path)
+    ids = {entry[1]: entry[0] for entry in first}
+    (tmp_path / "b.jpg").unlink()
+    (tmp_path / "0.jpg").write_bytes(b"x")
+    second = server.AlbumEntries.scan(tmp_path, first)
+    (tmp_path / "0.jpg").unlink()
+    (tmp_path / "d.jpg").write_bytes(b"x")
+    third = server.AlbumEntries.scan(tmp_path, server.AlbumEntries.from_marshal(second.to_marshal()))
+
+    assert {entry[1]: entry[0] for entry in second} == {"a.jpg": ids["a.jpg"], "c.jpg": ids["c.jpg"], "0.jpg": 4}
+    assert {entry[1]: entry[0] for entry in third} == {"a.jpg": ids["a.jpg"], "c.jpg": ids["c.jpg"], "d.jpg": 5}
+    assert list(third.positions) == sorted(third.positions)
+
+
+def test_upload_is_appended_without_a_rescan(tmp_path, catalog_log, monkeypatch):
+    (tmp_path / "a.jpg").write_bytes(b"x")
+    monkeypatch.setattr(server, "album_catalogs", {})
+    entries = server.album_entries("default", tmp_path)
+    since = catalog_log["version"]
+    with server.album_write_lock:
+        signature = server.album_directory_signature(tmp_path)
+        (tmp_path / "b.jpg").write_bytes(b"y")
+        image_id = server.add_catalog_entry("default", tmp_path, tmp_path / "b.jpg", signature)
+    monkeypatch.setattr(server.AlbumEntries, "scan", None)
+
+    assert server.album_entries("default", tmp_path) is entries
+    assert image_id == "2"
+    assert entries.find(-1, b"b.jpg") == 1
+    assert server.catalog_changes_since(since) == {("default", 2): "added"}
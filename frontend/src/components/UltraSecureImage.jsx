@@ -1,5 +1,6 @@
 import React, { useRef, useEffect, useState, useCallback, useMemo } from 'react';
 import apiService from '../services/api';
+import minimalSecurity from '../services/minimalSecurity';
 import brandingConfig from '../config/branding';
 
 const UltraSecureImage = ({ imageUrl, alt, className, style, onLoad, onError }) => {
@@ -649,16 +650,8 @@ const UltraSecureImage = ({ imageUrl, alt, className, style, onLoad, onError })
   const handleSecurityViolation = (violation) => {
     apiService.reportSuspiciousActivity(`SECURITY VIOLATION: ${violation}`);
     
-    // Log to backend
-    fetch('/api/security-violation', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        violation,
-        timestamp: new Date().toISOString(),
-        userAgent: navigator.userAgent
-      })
-    }).catch(() => {}); // Silent fail
+    // Log to backend (batched)
+    minimalSecurity.queueViolation(violation, { userAgent: navigator.userAgent });
     
     // Visual feedback
     if (canvasRef.current) {
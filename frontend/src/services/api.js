@@ -1,5 +1,6 @@
 import axios from 'axios';
 import brandingConfig from '../config/branding';
+import minimalSecurity from './minimalSecurity';
 
 // Auto-detect backend URL based on environment
 const getBackendURL = () => {
@@ -719,18 +720,11 @@ async initializeSession() {
   reportSuspiciousActivity(activity) {
     console.warn(`🚨 Suspicious activity detected - ${activity}`);
     
-    // Send to backend for logging
-    try {
-      this.api.post('/security-violation', {
-        violation: `SECURITY: ${activity}`,
-        timestamp: new Date().toISOString(),
-        userAgent: navigator.userAgent,
-        url: window.location.href,
-        ip: 'client-side'
-      }).catch(() => {}); // Silent fail
-    } catch (e) {
-      // Silent fail
-    }
+    // Queue for the batched security event sink
+    minimalSecurity.queueViolation(`SECURITY: ${activity}`, {
+      userAgent: navigator.userAgent,
+      url: window.location.href
+    });
     
     // Show user warning
     this.showSecurityWarning(`🚨 Security Alert: ${activity}`);
@@ -740,18 +734,13 @@ async initializeSession() {
   reportError(errorData) {
     console.error('🚨 Error:', errorData);
     
-    // Send to backend for logging
-    try {
-      this.api.post('/security-violation', {
-        violation: `ERROR: ${errorData.source} - ${errorData.error}`,
-        timestamp: errorData.timestamp,
-        userAgent: navigator.userAgent,
-        url: window.location.href,
-        stack: errorData.stack || 'N/A'
-      }).catch(() => {}); // Silent fail
-    } catch (e) {
-      // Silent fail
-    }
+    // Queue for the batched security event sink
+    minimalSecurity.queueViolation(`ERROR: ${errorData.source} - ${errorData.error}`, {
+      timestamp: errorData.timestamp,
+      userAgent: navigator.userAgent,
+      url: window.location.href,
+      stack: errorData.stack || 'N/A'
+    });
   }
 
   // Show security warning to user
@@ -55,6 +55,15 @@ class BasicSecurityService {
   // Setup backend communication
   setupBackendCommunication() {
     this.backendUrl = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8000';
+    this.pendingEvents = [];
+    this.flushTimer = null;
+    
+    // Deliver anything still buffered when the page is hidden or unloaded
+    const flushOnHide = () => this.flushEvents(true);
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'hidden') flushOnHide();
+    });
+    window.addEventListener('pagehide', flushOnHide);
     
     // Report initial session
     this.reportToBackend('session_start', {
@@ -64,26 +73,54 @@ class BasicSecurityService {
     });
   }
 
-  // Report to backend
-  async reportToBackend(event, data) {
-    try {
-      await fetch(`${this.backendUrl}/api/security-event`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-Session-ID': this.sessionId
-        },
-        body: JSON.stringify({
-          event,
-          data,
-          timestamp: new Date().toISOString()
-        })
-      });
-    } catch (error) {
-      console.warn('Failed to report to backend:', error);
+  // Report to backend (buffered, sent in batches)
+  reportToBackend(event, data) {
+    this.queueEvent({ event, data });
+  }
+
+  // Report a violation to backend through the same batch queue
+  queueViolation(violation, details = {}) {
+    this.queueEvent({ violation, ...details });
+  }
+
+  queueEvent(record) {
+    this.pendingEvents.push({
+      sessionId: this.sessionId,
+      timestamp: new Date().toISOString(),
+      ...record
+    });
+    
+    if (this.pendingEvents.length >= 50) {
+      this.flushEvents();
+    } else if (!this.flushTimer) {
+      this.flushTimer = setTimeout(() => this.flushEvents(), 2000);
     }
   }
 
+  // Send buffered events in one request
+  flushEvents(useBeacon = false) {
+    clearTimeout(this.flushTimer);
+    this.flushTimer = null;
+    if (this.pendingEvents.length === 0) return;
+    
+    const body = JSON.stringify(this.pendingEvents);
+    this.pendingEvents = [];
+    const url = `${this.backendUrl}/api/security-events/batch`;
+    
+    if (useBeacon && navigator.sendBeacon && navigator.sendBeacon(url, body)) return;
+    fetch(url, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-Session-ID': this.sessionId
+      },
+      body,
+      keepalive: true
+    }).catch((error) => {
+      console.warn('Failed to report to backend:', error);
+    });
+  }
+
   // Show warning message
   showWarning(message) {
     // Only show if no existing warning